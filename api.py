@@ -1,94 +1,199 @@
 from steamship import Steamship
 from steamship.invocable import post, PackageService
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import logging
+import re
+import threading
 import typing
 
+# maximum number of LLM calls allowed in flight at once
+MAX_CONCURRENCY = 10
+
+# separates the per-header sections of a batched response, only when on a line of its own
+SECTION_DELIMITER = "---"
+_SECTION_DELIMITER_RE = re.compile(r"^[ \t]*" + re.escape(SECTION_DELIMITER) + r"[ \t]*$", re.MULTILINE)
+
+# how a model echoes a header back: markdown emphasis, a "Header N:" label, a trailing colon
+_HEADER_EMPHASIS_CHARS = str.maketrans("", "", "*_`#")
+_HEADER_LABEL_RE = re.compile(r"^(?:header|section)[ \t]*\d*[ \t]*:[ \t]*", re.IGNORECASE)
+
+# prompt templates, filled in with str.format_map
+OUTLINE_PROMPT = """Generate three headers for a technical article titled {title}
+      focused on {keywords} with a {tone} tone"""
+TALKING_POINTS_PROMPT = """Generate three short talking points about {header} with a {tone} tone"""
+BATCH_TALKING_POINTS_PROMPT = """Generate three short talking points with a {tone} tone for EACH of the following headers.
+    Separate the talking points of each header with a line containing only {delimiter}
+    and do not repeat the headers:
+    {headers}"""
+SECTION_PROMPT = "The section {header} should be about {points}."
+ARTICLE_PROMPT = """Generate a technical article with title {title} in a {tone} tone.
+    The article should have three sections: {sections}. {sentences} The article should also
+    include an introduction paragraph and a conclusion paragraph. Do not repeat any sentences."""
+
+# one list item per line: a leading numbering marker not followed by a digit (so "1.5x"
+# is kept), a bullet followed by whitespace (so "-5" is kept), and trailing periods are dropped
+_LIST_ITEM_RE = re.compile(
+  r"^[ \t]*(?:\d+[.)](?!\d)|[-*\u2022](?=[ \t]))?[ \t]*(.*?)[ \t\r.]*$", re.MULTILINE
+)
+
+# in-process LRU cache of LLM responses, keyed on plugin, config and prompt
+RESPONSE_CACHE_SIZE = 1024
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
 class PromptPackage(PackageService):
   POINTS_LLM_CONFIG = {
     "max_words": 150,
     "temperature": 0.75
   }
+  BATCH_POINTS_LLM_CONFIG = {
+    "max_words": 450,
+    "temperature": 0.75
+  }
   ARTICLE_LLM_CONFIG = {
     "max_words": 2500,
     "temperature": 0.5
   }
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    # plugin handles are resolved once per instance, which Steamship builds for every
+    # invocation, and shared by all the calls that invocation makes
+    if self.client is not None:
+      self._points_llm = self.client.use_plugin("gpt-3", "points", config=self.POINTS_LLM_CONFIG)
+      self._article_llm = self.client.use_plugin("gpt-3", "article", config=self.ARTICLE_LLM_CONFIG)
+    # only generate uses the batch plugin, so it is resolved on first use
+    self._batch_points_llm = None
   
   # generate
   @post("generate")
-  def generate(self, title: str, tone:str, tags: str) -> str:
+  def generate(self, title: str, tone:str, tags: str, no_cache: bool = False) -> str:
     """Generates an article using title, tone, and a comma 
     separated list of tags input as a string"""
     # initialize
+    use_cache = not no_cache
     tags = [tag.strip() for tag in tags.split(",")]
 
-    headers = self.generate_outline(title, tags, tone)
+    headers = self.generate_outline(title, tags, tone, use_cache)
     headers_list = response_to_list(headers.strip())
 
     # create a map of headers to paragraphs
-    # turn each header into a section via talking points
-    header_talking_points_map = {}
-    for header in headers_list:
-      talking_points = self.generate_talking_points(header, tone)
-      header_talking_points_map[header] = response_to_list(talking_points)
+    # turn each header into a section via talking points, all headers in one call
+    talking_points = self.generate_talking_points_batch(headers_list, tone, use_cache)
+    if len(talking_points) != len(headers_list):
+      # the response did not keep one section per header, ask for each header separately
+      logging.warning(
+        "batched talking points had %d sections for %d headers, falling back to one call per header",
+        len(talking_points), len(headers_list)
+      )
+      talking_points = self.generate_all_talking_points(headers_list, tone, use_cache)
+    header_talking_points_map = dict(zip(headers_list, talking_points))
 
     # generate and save article
-    article = self.generate_article(title, header_talking_points_map, tone)
+    article = self.generate_article(title, header_talking_points_map, tone, use_cache)
     return article
 
+  def _generate(self, llm, config: dict, prompt: str, clean_output: bool = True, use_cache: bool = False) -> str:
+    """Generates text with llm, reusing the stored response for a repeated prompt"""
+    if not use_cache:
+      return llm.generate(prompt, clean_output=clean_output)
+
+    key = cache_key(llm.handle, config, prompt, clean_output)
+    with _response_cache_lock:
+      if key in _response_cache:
+        _response_cache.move_to_end(key)
+        return _response_cache[key]
+
+    response = llm.generate(prompt, clean_output=clean_output)
+    with _response_cache_lock:
+      _response_cache[key] = response
+      if len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+    return response
+
   # generate section headers 
-  @post("generate_outline")
-  def generate_outline(self, title: str, keywords: typing.List[str], tone: str) -> str:
+  def generate_outline(self, title: str, keywords: typing.List[str], tone: str, use_cache: bool = False) -> str:
     """Generates an outline based on title, keywords, and tone supplied by user"""
-    prompt = f"""Generate three headers for a technical article titled {title}
-      focused on {", ".join(keywords)} with a {tone} tone"""
+    prompt = OUTLINE_PROMPT.format_map({"title": title, "keywords": ", ".join(keywords), "tone": tone})
 
-    points_llm = self.client.use_plugin("gpt-3",  "points", config=self.POINTS_LLM_CONFIG)
-    return points_llm.generate(prompt, clean_output=False)
+    return self._generate(self._points_llm, self.POINTS_LLM_CONFIG, prompt, clean_output=False, use_cache=use_cache)
 
   # generate talking points for each section header
-  @post("generate_talking_points")
-  def generate_talking_points(self, header: str, tone: str) -> str:
+  def generate_talking_points(self, header: str, tone: str, use_cache: bool = False) -> str:
     """Generates three talking points for the outline"""
-    prompt = f"""Generate three short talking points about {header} with a {tone} tone"""
+    prompt = TALKING_POINTS_PROMPT.format_map({"header": header, "tone": tone})
 
-    points_llm = self.client.use_plugin("gpt-3", "points", config=self.POINTS_LLM_CONFIG)
+    return self._generate(self._points_llm, self.POINTS_LLM_CONFIG, prompt, clean_output=False, use_cache=use_cache)
 
-    return points_llm.generate(prompt, clean_output=False)
+  def generate_talking_points_batch(self, headers: typing.List[str], tone: str, use_cache: bool = False) -> typing.List[typing.List[str]]:
+    """Generates three talking points for every header with a single call,
+    returning the list of points of each response section"""
+    numbered_headers = "\n".join(f"{i}) {header}" for i, header in enumerate(headers, 1))
+    prompt = BATCH_TALKING_POINTS_PROMPT.format_map(
+      {"tone": tone, "delimiter": SECTION_DELIMITER, "headers": numbered_headers}
+    )
+
+    if self._batch_points_llm is None:
+      self._batch_points_llm = self.client.use_plugin("gpt-3", "points-batch", config=self.BATCH_POINTS_LLM_CONFIG)
+    # raw output, since cleaning could cut a last section that ends without punctuation
+    response = self._generate(self._batch_points_llm, self.BATCH_POINTS_LLM_CONFIG, prompt, clean_output=False, use_cache=use_cache)
+    # the model may echo the numbered headers, which are not talking points
+    echoed_headers = {normalize_header(item) for header in headers for item in response_to_list(header)}
+    sections = [section for section in _SECTION_DELIMITER_RE.split(response) if section.strip() != ""]
+    return [
+      [point for point in response_to_list(section) if normalize_header(point) not in echoed_headers]
+      for section in sections
+    ]
+
+  def generate_all_talking_points(self, headers: typing.List[str], tone: str, use_cache: bool = False) -> typing.List[typing.List[str]]:
+    """Generates talking points for every header concurrently, in header order"""
+    # the plugin client is blocking, so a bounded thread pool caps the calls in flight
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+      responses = executor.map(lambda header: self.generate_talking_points(header, tone, use_cache), headers)
+      return [response_to_list(response) for response in responses]
 
   # generate article
-  @post("generate_article")
-  def generate_article(self, title: str, header_point_map: dict, tone: str) -> str:
+  def generate_article(self, title: str, header_point_map: dict, tone: str, use_cache: bool = False) -> str:
     """Generates three talking points for the outline"""
     sections = ", ".join(header_point_map.keys())
 
-    sentences = []
-    for header, points in header_point_map.items():
-        sentences.append(f"The section {header} should be about {', '.join(points)}.")
-    sentences = " ". join(sentences)
+    sentences = " ".join(
+      SECTION_PROMPT.format_map({"header": header, "points": ", ".join(points)})
+      for header, points in header_point_map.items()
+    )
 
-    prompt = f"""Generate a technical article with title {title} in a {tone} tone.
-    The article should have three sections: {sections}. {sentences} The article should also
-    include an introduction paragraph and a conclusion paragraph. Do not repeat any sentences."""
+    prompt = ARTICLE_PROMPT.format_map(
+      {"title": title, "tone": tone, "sections": sections, "sentences": sentences}
+    )
 
-    points_llm = self.client.use_plugin("gpt-3", "article", config=self.ARTICLE_LLM_CONFIG)
-    return points_llm.generate(prompt)
+    return self._generate(self._article_llm, self.ARTICLE_LLM_CONFIG, prompt, use_cache=use_cache)
+
+def cache_key(plugin: str, config: dict, prompt: str, clean_output: bool) -> str:
+  """hash everything that determines an LLM response into a cache key"""
+  payload = json.dumps([plugin, config, prompt, clean_output], sort_keys=True)
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def normalize_header(text: str) -> str:
+  """reduce a header, or a line echoing one, to a comparable form"""
+  text = _HEADER_LABEL_RE.sub("", text.translate(_HEADER_EMPHASIS_CHARS).strip())
+  return text.rstrip(": \t").casefold()
 
 def response_to_list(response: str) -> typing.List[str]:
   """turn a response string into a list of string, used for GPT3 response
   when asking for a list of items"""
-  response_list = []
-  item = ""
-  for char in response:
-    if not char.isdigit() and char != '.':
-      item += char
-    if char == "\n" and item.strip() != "":
-      response_list.append(item.strip())
-      item = ""
-  if item != "":
-    response_list.append(item.strip())
-  return response_list
+  return [item for item in _LIST_ITEM_RE.findall(response) if item != ""]
 
 # Try it out locally by running this file!
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--no-cache", action="store_true", help="always call the LLM, ignoring cached responses")
+  args = parser.parse_args()
+  use_cache = not args.no_cache
+
   with Steamship.temporary_workspace() as client:
     # initialize
     gen_ai = PromptPackage(client)
@@ -97,41 +202,50 @@ if __name__ == "__main__":
     tags = input("Enter up to 5 tags for your article (separated by commas) ")
     tags = [tag.strip() for tag in tags.split(",")]
 
-    headers = gen_ai.generate_outline(title, tags, tone)
+    headers = gen_ai.generate_outline(title, tags, tone, use_cache)
     headers_list = response_to_list(headers.strip())
 
-    # print headers and ask for edits
-    print(headers.strip())
-    edit = input("Would you like to edit the headers? (Y/n) ")
-    while edit.lower() == "y":
-      num_header = int(input("Which header would you like to edit? "))
-      print(f"Current header: {headers_list[num_header-1]}")
-      new_header = input("Please re-write the header as you desire\n")
-      headers_list[num_header-1] = new_header
-      edit = input("Would you like to continue editing the headers? (Y/n) ")
-  
-    print("Generating Talking Points using ...")
-    for header in headers_list:
-      print(header)
-
-    # create a map of headers to paragraphs
-    # turn each header into a section via talking points
-    header_talking_points_map = {}
-    for header in headers_list:
-      talking_points = gen_ai.generate_talking_points(header, tone)
-      header_talking_points_map[header] = response_to_list(talking_points)
-      print(f"\033[1;32mHeader: {header}\nPoints:\033[0;37m")
-      for point in header_talking_points_map[header]:
-        print(point)
-      edit = input("Would you like to edit any points? (Y/n) ")
+    # start generating talking points right away so they run while the user reviews
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+    futures = {header: executor.submit(gen_ai.generate_talking_points, header, tone, use_cache) for header in headers_list}
+    try:
+      # print headers and ask for edits
+      print(headers.strip())
+      edit = input("Would you like to edit the headers? (Y/n) ")
       while edit.lower() == "y":
-        points = header_talking_points_map[header]
-        # get the point to be edited
-        num_point = int(input("Which point would you like to edit? "))
-        print(header_talking_points_map[header][num_point-1])
-        new_point = input("Please re-write the point as you desire\n")
-        points[num_point-1] = new_point
+        num_header = int(input("Which header would you like to edit? "))
+        print(f"Current header: {headers_list[num_header-1]}")
+        new_header = input("Please re-write the header as you desire\n")
+        headers_list[num_header-1] = new_header
+        if new_header not in futures:
+          futures[new_header] = executor.submit(gen_ai.generate_talking_points, new_header, tone, use_cache)
         edit = input("Would you like to continue editing the headers? (Y/n) ")
+
+      print("Generating Talking Points using ...")
+      for header in headers_list:
+        print(header)
+
+      # create a map of headers to paragraphs
+      # turn each header into a section via talking points
+      # each header only waits on its own call, the rest keep running during edits
+      header_talking_points_map = {}
+      for header in headers_list:
+        header_talking_points_map[header] = response_to_list(futures[header].result())
+        print(f"\033[1;32mHeader: {header}\nPoints:\033[0;37m")
+        for point in header_talking_points_map[header]:
+          print(point)
+        edit = input("Would you like to edit any points? (Y/n) ")
+        while edit.lower() == "y":
+          points = header_talking_points_map[header]
+          # get the point to be edited
+          num_point = int(input("Which point would you like to edit? "))
+          print(header_talking_points_map[header][num_point-1])
+          new_point = input("Please re-write the point as you desire\n")
+          points[num_point-1] = new_point
+          edit = input("Would you like to continue editing the headers? (Y/n) ")
+    finally:
+      # drop any calls for headers that were edited away
+      executor.shutdown(wait=False, cancel_futures=True)
     
     # inform user that article is being generated
     print("Generating Article using ...")
@@ -141,7 +255,7 @@ if __name__ == "__main__":
         print(point)
 
     # generate and save article
-    article = gen_ai.generate_article(title, header_talking_points_map, tone)
+    article = gen_ai.generate_article(title, header_talking_points_map, tone, use_cache)
 
     # generate and save article
     with open(f"{title}.txt", "w") as f:
@@ -1,16 +1,22 @@
 from steamship import Steamship
-    
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--no-cache", action="store_true", help="always call the LLM, ignoring cached responses")
+args = parser.parse_args()
+
 # Load the package instance stub.
 pkg = Steamship.use(
     "copy-ai-clone",
     instance_handle="copy-ai-clone-6"
 )
 
-# Invoke the method
+# Invoke the single endpoint; the outline -> points -> article chain runs server-side
 resp = pkg.invoke(
     "generate",
     title="Generative AI in 2023",
     tone="formal",
-    tags=["Prompt Engineering", "GPT-3", "Generative AI"]
+    tags="Prompt Engineering, GPT-3, Generative AI",
+    no_cache=args.no_cache
 )
 print(resp)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import pytest
+
+import api
+from api import PromptPackage, cache_key, response_to_list
+
+
+def test_numbered_list():
+  assert response_to_list("1. Intro to GPT-3.\n2) Web 2.0 trends\n3. Outlook") == [
+    "Intro to GPT-3", "Web 2.0 trends", "Outlook"
+  ]
+  assert response_to_list("1.Intro\n2.Body\n3)Outlook") == ["Intro", "Body", "Outlook"]
+
+def test_bulleted_list():
+  assert response_to_list("- first\n* second.\n• third") == ["first", "second", "third"]
+
+def test_crlf_and_blank_lines():
+  assert response_to_list("\r\n1. first\r\n\r\n2. second\r\n") == ["first", "second"]
+
+def test_inline_digits_and_markers_are_kept():
+  assert response_to_list("1.5x faster inference\n-5 degrees\nTrends for 2023") == [
+    "1.5x faster inference", "-5 degrees", "Trends for 2023"
+  ]
+
+
+class FakeLLM:
+  def __init__(self, handle="points", respond=None):
+    self.handle = handle
+    self.respond = respond or (lambda prompt: f"response to {prompt}")
+    self.prompts = []
+
+  def generate(self, prompt, clean_output=True):
+    self.prompts.append(prompt)
+    return self.respond(prompt)
+
+
+class FakeClient:
+  def use_plugin(self, plugin_handle, instance_handle, config=None):
+    return FakeLLM(instance_handle)
+
+
+@pytest.fixture
+def gen_ai():
+  api._response_cache.clear()
+  yield PromptPackage(FakeClient())
+  api._response_cache.clear()
+
+def test_cache_key_ignores_config_key_order():
+  assert cache_key("points", {"max_words": 150, "temperature": 0.75}, "prompt", False) == cache_key(
+    "points", {"temperature": 0.75, "max_words": 150}, "prompt", False
+  )
+
+def test_cache_key_depends_on_every_input():
+  key = cache_key("points", {"max_words": 150}, "prompt", False)
+  assert key != cache_key("article", {"max_words": 150}, "prompt", False)
+  assert key != cache_key("points", {"max_words": 151}, "prompt", False)
+  assert key != cache_key("points", {"max_words": 150}, "other prompt", False)
+  assert key != cache_key("points", {"max_words": 150}, "prompt", True)
+
+def test_generate_caches_repeated_prompts(gen_ai):
+  llm = FakeLLM()
+  assert gen_ai._generate(llm, {}, "a", use_cache=True) == "response to a"
+  assert gen_ai._generate(llm, {}, "a", use_cache=True) == "response to a"
+  assert gen_ai._generate(llm, {}, "b", use_cache=True) == "response to b"
+  assert llm.prompts == ["a", "b"]
+
+def test_generate_without_cache_always_calls_llm(gen_ai):
+  llm = FakeLLM()
+  gen_ai._generate(llm, {}, "a", use_cache=True)
+  gen_ai._generate(llm, {}, "a", use_cache=False)
+  assert llm.prompts == ["a", "a"]
+
+def test_generate_cache_is_bounded(gen_ai, monkeypatch):
+  monkeypatch.setattr(api, "RESPONSE_CACHE_SIZE", 2)
+  llm = FakeLLM()
+  for prompt in ["a", "b", "c", "a"]:
+    gen_ai._generate(llm, {}, prompt, use_cache=True)
+  assert llm.prompts == ["a", "b", "c", "a"]
+  assert len(api._response_cache) == 2
+
+def test_batch_splits_only_on_delimiter_lines(gen_ai):
+  gen_ai._batch_points_llm = FakeLLM("points-batch", lambda prompt: "1. a\n2. b --- c\n  ---  \n1. d\n---\n1. e")
+  assert gen_ai.generate_talking_points_batch(["One", "Two", "Three"], "formal") == [
+    ["a", "b --- c"], ["d"], ["e"]
+  ]
+
+def test_batch_drops_echoed_headers(gen_ai):
+  response = (
+    "**Intro to GPT-3**\n1. a\n---\nHeader 2: Prompt Engineering\n1. c\n---\n"
+    "3) the outlook:\n1. e"
+  )
+  gen_ai._batch_points_llm = FakeLLM("points-batch", lambda prompt: response)
+  headers = ["Intro to GPT-3", "Prompt Engineering", "The Outlook"]
+  assert gen_ai.generate_talking_points_batch(headers, "formal") == [["a"], ["c"], ["e"]]
+
+def test_generate_falls_back_when_sections_do_not_match_headers(gen_ai):
+  def respond_points(prompt):
+    if prompt.startswith("Generate three headers"):
+      return "1. One\n2. Two"
+    return "1. point"
+  gen_ai._points_llm = FakeLLM("points", respond_points)
+  gen_ai._batch_points_llm = FakeLLM("points-batch", lambda prompt: "1. only one section")
+  gen_ai._article_llm = FakeLLM("article", lambda prompt: prompt)
+
+  article = gen_ai.generate("Title", "formal", "a, b", no_cache=True)
+  assert len(gen_ai._points_llm.prompts) == 3
+  assert "The section One should be about point." in article
+  assert "The section Two should be about point." in article